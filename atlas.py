@@ -0,0 +1,225 @@
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import xml.etree.ElementTree as ElementTree
+import pygame
+from pytmx.util_pygame import handle_transformation, pygame_image_loader, smart_convert
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_PATH = '../data/assets.pak'
+MAGIC = b'ERP2'
+PAGE_SIZE = 2048
+
+# images que map.py lit avec assets.load, en plus des tilesets des cartes
+HUD_IMAGES = [
+    '../graphics/Tools/Morceau de CD.png',
+    '../graphics/Tools/Morceau de CD2.png',
+    '../graphics/Tools/Morceau de CD3.png',
+    '../graphics/Tools/Morceau de CD4.png',
+    '../graphics/labo/endgame_image.jpg',
+]
+
+
+def key(path):
+    return os.path.normpath(path)
+
+
+def tileset_files(filename):
+    # les .tsx et les images de tilesets dont dépend une carte
+    files = []
+    for _, node in ElementTree.iterparse(filename):
+        if node.tag != 'tileset':
+            continue
+        folder = os.path.dirname(filename)
+        if node.get('source'):
+            path = os.path.join(folder, node.get('source'))
+            files.append(key(path))
+            node = ElementTree.parse(path).getroot()
+            folder = os.path.dirname(path)
+        for image in node.iter('image'):
+            files.append(key(os.path.join(folder, image.get('source'))))
+    return files
+
+
+def tileset_images(tmx_folder='../data/tmx'):
+    # les images de tilesets réellement utilisées par les cartes
+    images = set()
+    for filename in glob.glob(os.path.join(tmx_folder, '*.tmx')):
+        images |= {path for path in tileset_files(filename) if not path.endswith('.tsx')}
+    return images
+
+
+def pack(sizes):
+    """Range les images par étagères dans des pages de PAGE_SIZE.
+
+    Renvoie {chemin: (page, x, y)} et la taille de chaque page.
+    """
+    placements = {}
+    pages = []
+    shared = None  # page en cours de remplissage
+    x = y = shelf_h = 0
+
+    for path, (w, h) in sorted(sizes.items(), key=lambda item: -item[1][1]):
+        if w > PAGE_SIZE or h > PAGE_SIZE:
+            # trop grande : une page à elle seule
+            placements[path] = (len(pages), 0, 0)
+            pages.append((w, h))
+            continue
+
+        if x + w > PAGE_SIZE:
+            x, y, shelf_h = 0, y + shelf_h, 0
+        if shared is None or y + h > PAGE_SIZE:
+            shared = len(pages)
+            pages.append(None)
+            x = y = shelf_h = 0
+
+        placements[path] = (shared, x, y)
+        x += w
+        shelf_h = max(shelf_h, h)
+
+    # taille utile des pages partagées
+    for index, size in enumerate(pages):
+        if size is None:
+            used = [(px + sizes[p][0], py + sizes[p][1]) for p, (page, px, py) in placements.items() if page == index]
+            pages[index] = (max(w for w, _ in used), max(h for _, h in used))
+
+    return placements, pages
+
+
+def build(sources=None, output=ARCHIVE_PATH):
+    """Construit l'archive : pages d'atlas en RGBA brut, précédées d'un index json.
+
+    Seules les images que le jeu lit avec assets sont rangées : les tilesets
+    des cartes et les images du HUD.
+    """
+    if sources is None:
+        sources = tileset_images() | {key(path) for path in HUD_IMAGES}
+
+    images = {path: pygame.image.load(path) for path in sorted(sources)}
+    placements, page_sizes = pack({path: image.get_size() for path, image in images.items()})
+
+    pages = [pygame.Surface(size, pygame.SRCALPHA, 32) for size in page_sizes]
+    index = {'pages': [], 'images': {}}
+    for path, (page, x, y) in placements.items():
+        pages[page].blit(images[path], (x, y))
+        # date et taille de la source, pour reconnaître une image modifiée depuis
+        stat = os.stat(path)
+        index['images'][path] = [page, x, y, *images[path].get_size(), stat.st_mtime_ns, stat.st_size]
+
+    # pixels bruts : une page se lit directement dans l'archive projetée, sans décodage
+    blobs = [pygame.image.tostring(page, 'RGBA') for page in pages]
+
+    # les offsets des pages sont relatifs à la fin de l'index
+    offset = 0
+    for blob, size in zip(blobs, page_sizes):
+        index['pages'].append([offset, *size])
+        offset += len(blob)
+    header = json.dumps(index).encode()
+
+    with open(output, 'wb') as file:
+        file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for blob in blobs:
+            file.write(blob)
+
+
+class AssetArchive:
+    """Lecture des images depuis l'archive, projetée en mémoire.
+
+    Les pages sont des pixels RGBA bruts : une surface est posée directement
+    sur la projection du fichier (pygame.image.frombuffer), sans copie ni
+    décodage, et le système ne lit que les parties utilisées. Une image
+    absente de l'archive (ou une archive absente ou d'un ancien format) est
+    lue sur le disque comme avant, de même qu'une image modifiée depuis la
+    construction de l'archive.
+    """
+
+    def __init__(self, path=ARCHIVE_PATH):
+        self.path = path
+        self.opened = False
+        self.data = None
+        self.index = {}
+        self.page_offsets = []
+        self.start = 0
+        self.pages = {}
+        self.stale = set()
+
+    def open(self):
+        self.opened = True
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:4] != MAGIC:
+            self.data = None
+            return
+
+        header_len = struct.unpack('<I', self.data[4:8])[0]
+        header = json.loads(self.data[8:8 + header_len])
+        self.index = header['images']
+        self.page_offsets = header['pages']
+        self.start = 8 + header_len
+
+    def page(self, number):
+        if number not in self.pages:
+            offset, width, height = self.page_offsets[number]
+            start = self.start + offset
+            pixels = memoryview(self.data)[start:start + width * height * 4]
+            self.pages[number] = pygame.image.frombuffer(pixels, (width, height), 'RGBA')
+        return self.pages[number]
+
+    def entry(self, path):
+        # place de l'image dans l'archive, ou None si elle n'y est pas ou n'est plus à jour
+        if not self.opened:
+            self.open()
+        entry = self.index.get(key(path))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # jeu distribué avec l'archive seule
+            return entry
+        if entry[5:] != [stat.st_mtime_ns, stat.st_size]:
+            if key(path) not in self.stale:
+                self.stale.add(key(path))
+                logger.warning('%s a changé depuis la construction de %s, lu sur le disque '
+                               '(relancer python atlas.py)', path, self.path)
+            return None
+        return entry
+
+    def load(self, path):
+        entry = self.entry(path)
+        if entry is None:
+            return pygame.image.load(path)
+        page, x, y, w, h = entry[:5]
+        return self.page(page).subsurface((x, y, w, h))
+
+    def tmx_image_loader(self, filename, colorkey, **kwargs):
+        # même rôle que pytmx.util_pygame.pygame_image_loader, avec les images de l'archive
+        if self.entry(filename) is None:
+            return pygame_image_loader(filename, colorkey, **kwargs)
+
+        if colorkey:
+            colorkey = pygame.Color('#{0}'.format(colorkey))
+        pixelalpha = kwargs.get('pixelalpha', True)
+        image = self.load(filename)
+
+        def load_image(rect=None, flags=None):
+            tile = image.subsurface(rect) if rect else image.copy()
+            if flags:
+                tile = handle_transformation(tile, flags)
+            return smart_convert(tile, colorkey, pixelalpha)
+
+        return load_image
+
+
+assets = AssetArchive()
+
+
+if __name__ == '__main__':
+    build()
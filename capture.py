@@ -0,0 +1,111 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import pygame
+
+logger = logging.getLogger(__name__)
+
+
+def save_png(path, size, pixels):
+    # exécuté dans un processus à part : pygame garde le GIL pendant tout l'encodage png
+    pygame.image.save(pygame.image.frombuffer(pixels, size, 'RGB'), path)
+
+
+class FrameRecorder:
+    """Enregistre les frames affichées sans bloquer la boucle du jeu.
+
+    Chaque frame est copiée dans une des surfaces d'un anneau alloué au
+    départ, puis un thread l'écrit sur le disque : en vidéo brute RGB
+    (``.rgb``, lisible avec ffmpeg -f rawvideo) ou en suite d'images png
+    numérotées par frame du jeu. L'encodage png bloquerait tout le
+    processus, il est donc fait par des processus à part (démarrés en
+    ``spawn`` : le script du jeu doit être protégé par
+    ``if __name__ == '__main__'``). Si l'écriture prend du retard et que
+    l'anneau est plein, la frame est abandonnée et notée au lieu de faire
+    attendre le jeu. À la fin, un fichier json à côté (``.rgb.json``, ou
+    ``capture.json`` dans le dossier) donne la taille, les ips et les
+    numéros des frames abandonnées, pour décoder la vidéo et retrouver son
+    rythme.
+    """
+
+    def __init__(self, screen, output, fps=60, ring_size=8, encoders=2):
+        self.screen = screen
+        self.output = output
+        self.fps = fps
+        self.frames = 0  # frames du jeu passées par capture
+        self.dropped = []  # numéros des frames abandonnées
+
+        self.buffers = [pygame.Surface(screen.get_size()).convert() for _ in range(ring_size)]
+        self.free = queue.Queue()
+        self.filled = queue.Queue()
+        for index in range(ring_size):
+            self.free.put(index)
+
+        self.image_sequence = not output.endswith('.rgb')
+        if self.image_sequence:
+            os.makedirs(output, exist_ok=True)
+            self.file = None
+            self.encoder_count = encoders
+            self.encoders = ProcessPoolExecutor(encoders, mp_context=multiprocessing.get_context('spawn'))
+            self.encoding = deque()
+        else:
+            self.file = open(output, 'wb')
+
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    def capture(self):
+        try:
+            index = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped.append(self.frames)
+        else:
+            self.buffers[index].blit(self.screen, (0, 0))
+            self.filled.put((index, self.frames))
+        self.frames += 1
+
+    def writer(self):
+        while True:
+            item = self.filled.get()
+            if item is None:
+                self.finish()
+                return
+
+            index, number = item
+            buffer = self.buffers[index]
+            pixels = pygame.image.tostring(buffer, 'RGB')
+            self.free.put(index)
+            if self.image_sequence:
+                # une image en cours par encodeur au plus : en cas de retard, c'est l'anneau qui se remplit
+                if len(self.encoding) >= self.encoder_count:
+                    self.encoding.popleft().result()
+                path = os.path.join(self.output, f'{number:06d}.png')
+                self.encoding.append(self.encoders.submit(save_png, path, buffer.get_size(), pixels))
+            else:
+                self.file.write(pixels)
+
+    def stop(self, wait=False):
+        # la fin de l'écriture se fait sur le thread : la boucle du jeu n'attend pas
+        self.filled.put(None)
+        if wait:
+            self.thread.join()
+
+    def finish(self):
+        if self.file:
+            self.file.close()
+        else:
+            self.encoders.shutdown(wait=True)
+
+        width, height = self.screen.get_size()
+        sidecar = os.path.join(self.output, 'capture.json') if self.image_sequence else self.output + '.json'
+        with open(sidecar, 'w') as file:
+            json.dump({'width': width, 'height': height, 'fps': self.fps, 'pixel_format': 'rgb24',
+                       'frames': self.frames, 'dropped': self.dropped}, file)
+
+        logger.info('capture %s : %d frames enregistrées, %d abandonnées (%dx%d à %d ips)',
+                    self.output, self.frames - len(self.dropped), len(self.dropped), width, height, self.fps)
@@ -0,0 +1,84 @@
+# taille des cases de la grille de murs, en pixels
+CELL_SIZE = 64
+
+
+class WallGrid:
+    """Murs d'une carte rangés dans une grille, pour ne tester que les murs proches."""
+
+    def __init__(self, walls):
+        self.cells = {}
+        for wall in walls:
+            for cell in self.cells_of(wall):
+                self.cells.setdefault(cell, []).append(wall)
+
+    @staticmethod
+    def cells_of(rect):
+        for cy in range(rect.top // CELL_SIZE, (rect.bottom - 1) // CELL_SIZE + 1):
+            for cx in range(rect.left // CELL_SIZE, (rect.right - 1) // CELL_SIZE + 1):
+                yield cx, cy
+
+    def near(self, rect):
+        walls = []
+        for cell in self.cells_of(rect):
+            for wall in self.cells.get(cell, ()):
+                if wall not in walls:
+                    walls.append(wall)
+        return walls
+
+
+def sweep(box, dx, dy, grid):
+    """Déplace la boîte d'abord sur x puis sur y, en s'arrêtant contre les murs.
+
+    Une boîte qui est déjà dans un mur (apparition, téléportation) en est
+    d'abord sortie par le côté le plus proche. Renvoie le déplacement
+    autorisé (dx, dy) et la liste des normales des murs touchés, par exemple
+    (-1, 0) pour un mur à droite.
+    """
+    normals = []
+    push_x = push_y = 0
+    for wall in grid.near(box):
+        if box.colliderect(wall):
+            push = min([(wall.right - box.left, 0), (wall.left - box.right, 0),
+                        (0, wall.bottom - box.top), (0, wall.top - box.bottom)],
+                       key=lambda offset: abs(offset[0]) + abs(offset[1]))
+            box = box.move(push)
+            push_x += push[0]
+            push_y += push[1]
+            normal = ((push[0] > 0) - (push[0] < 0), (push[1] > 0) - (push[1] < 0))
+            if normal not in normals:
+                normals.append(normal)
+
+    # un pixel de marge pour les déplacements non entiers des npcs
+    walls = grid.near(box.union(box.move(dx, dy)).inflate(2, 2))
+
+    if dx:
+        normal = None
+        for wall in walls:
+            # seuls les murs sur la même bande horizontale peuvent bloquer
+            if wall.bottom <= box.top or wall.top >= box.bottom:
+                continue
+            if dx > 0 and box.right <= wall.left < box.right + dx:
+                dx = wall.left - box.right
+                normal = (-1, 0)
+            elif dx < 0 and box.left + dx < wall.right <= box.left:
+                dx = wall.right - box.left
+                normal = (1, 0)
+        if normal and normal not in normals:
+            normals.append(normal)
+        box = box.move(dx, 0)
+
+    if dy:
+        normal = None
+        for wall in walls:
+            if wall.right <= box.left or wall.left >= box.right:
+                continue
+            if dy > 0 and box.bottom <= wall.top < box.bottom + dy:
+                dy = wall.top - box.bottom
+                normal = (0, -1)
+            elif dy < 0 and box.top + dy < wall.bottom <= box.top:
+                dy = wall.bottom - box.top
+                normal = (0, 1)
+        if normal and normal not in normals:
+            normals.append(normal)
+
+    return push_x + dx, push_y + dy, normals
@@ -0,0 +1,36 @@
+import pygame
+
+# taille native du jeu : les tuiles de 16 px sont composées à 1x sur cette surface
+NATIVE_SIZE = (240, 240)
+
+
+class Display:
+    """Fenêtre du jeu et surface sur laquelle le monde est composé.
+
+    Par défaut le monde est dessiné directement dans la fenêtre, zoomé par
+    pyscroll. En mode ``low_res``, il est composé dans une surface native de
+    240x240 à 1x, puis agrandi vers la fenêtre en une seule passe.
+    """
+
+    def __init__(self, scale=2, fullscreen=False, low_res=False):
+        self.scale = scale
+        self.low_res = low_res
+
+        size = (NATIVE_SIZE[0] * scale, NATIVE_SIZE[1] * scale)
+        flags = pygame.FULLSCREEN | pygame.SCALED if fullscreen else 0
+        self.window = pygame.display.set_mode(size, flags)
+
+        if low_res:
+            self.surface = pygame.Surface(NATIVE_SIZE).convert()
+        else:
+            self.surface = self.window
+
+    def present(self, cheap=False):
+        # un seul agrandissement entier de la frame native vers la fenêtre
+        if not self.low_res:
+            return
+
+        if self.scale == 2 and not cheap:
+            pygame.transform.scale2x(self.surface, self.window)
+        else:
+            pygame.transform.scale(self.surface, self.window.get_size(), self.window)
@@ -1,31 +1,58 @@
+import logging
+import os
+import time
 import pygame
 import pytmx
 import pyscroll
 from dialog import DialogBox
+from capture import FrameRecorder
+from display import Display
+from ghost import GhostRuns
+from hot_reload import MapWatcher
 from player import Player
+from quality import QualityGovernor
 from map import MapManager
 from start_menu import StartMenu
 
 
 class Game:
-    def __init__(self):
+    def __init__(self, low_res=False, window_scale=2, fullscreen=False, dev_mode=False, capture=None,
+                 quality_tier=None, ghost_folder='../data/ghosts'):
 
-        self.screen = pygame.display.set_mode((480, 480))
+        # changements de qualité, rechargements et bilans de capture sont écrits dans le terminal
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s: %(message)s')
+
+        # low_res : le monde est composé en 240x240 puis agrandi en une passe
+        self.display = Display(scale=window_scale, fullscreen=fullscreen, low_res=low_res)
+        self.screen = self.display.window
         pygame.display.set_caption('Eternal Run')
 
         # generer un joueur
         self.player = Player()
-        self.map_manager = MapManager(self.screen, self.player, self.end_timer)
+        self.quality = QualityGovernor(cheap_present=low_res)
+        if quality_tier is not None:
+            self.quality.pin(quality_tier)
+        self.map_manager = MapManager(self.display.surface, self.player, self.end_timer, self.quality)
         self.dialog_box = DialogBox()
         self.start_menu = StartMenu(self.start_game)
         self.game_started = False
         self.space_sound = pygame.mixer.Sound('../audio/sfx/DIALOGSOUND.wav')
 
+        # mode développeur : les cartes modifiées dans Tiled sont rechargées à chaud
+        self.map_watcher = MapWatcher(self.map_manager.maps) if dev_mode else None
+
+        # enregistrement des parties (F9), dès le lancement si un fichier est donné
+        self.recorder = FrameRecorder(self.screen, capture) if capture else None
+
+        # trajectoire de chaque partie, et fantôme du meilleur temps
+        self.ghost_runs = GhostRuns(self.map_manager, ghost_folder)
+
     def start_game(self):
         self.game_started = True
 
-    def handle_input(self):
-        pressed = pygame.key.get_pressed()
+    def handle_input(self, pressed=None):
+        if pressed is None:
+            pressed = pygame.key.get_pressed()
 
         if pressed[pygame.K_UP] or pressed[pygame.K_z]:
             self.player.move_up()
@@ -37,13 +64,81 @@ class Game:
             self.player.move_right()
 
     def update(self):
+        if self.map_watcher:
+            for name in self.map_watcher.poll():
+                if self.map_manager.reload_map(name):
+                    self.map_watcher.loaded(name)
         self.map_manager.update()
+        if self.game_started:
+            self.update_ghost_runs()
+
+    def update_ghost_runs(self):
+        endgame = self.map_manager.endgame
+        if self.ghost_runs.writer is None and not endgame:
+            # nouvelle partie : au lancement, ou après le retour au Spawn
+            self.timer_start = pygame.time.get_ticks()
+            self.ghost_runs.start()
+        elif self.ghost_runs.writer and endgame:
+            self.ghost_runs.finish(self.end_timer())
+        self.ghost_runs.update()
+
+    def toggle_capture(self):
+        if self.recorder:
+            self.recorder.stop()
+            self.recorder = None
+        else:
+            os.makedirs('../captures', exist_ok=True)
+            self.recorder = FrameRecorder(self.screen, time.strftime('../captures/run-%Y%m%d-%H%M%S.rgb'))
 
     def end_timer(self):
         current_time = pygame.time.get_ticks()
         delta_time = current_time - self.timer_start
         return delta_time
 
+    def step(self, events, pressed=None):
+        # une frame du jeu ; renvoie False quand la fenêtre est fermée
+        running = True
+        for event in events:
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYUP:
+                if event.key == pygame.K_SPACE:
+                    if self.map_manager.endgame is False:
+                        self.map_manager.check_npc_collisions(self.dialog_box)
+                        self.map_manager.check_interaction_collisions()
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_SPACE:
+                    if self.dialog_box.input_box.active is False and self.map_manager.endgame is False:
+                        self.space_sound.play()
+                elif event.key == pygame.K_m and self.dialog_box.input_box.active is False:
+                    self.map_manager.show_minimap = not self.map_manager.show_minimap
+                elif event.key == pygame.K_TAB:
+                    self.map_manager.show_overview = not self.map_manager.show_overview
+                elif event.key == pygame.K_F9:
+                    self.toggle_capture()
+
+        self.player.save_location()
+        if self.game_started:
+            if self.dialog_box.reading:
+                self.dialog_box.handle_input(events)
+            elif not self.map_manager.sign_active:
+                self.handle_input(pressed)
+        self.update()
+        self.map_manager.draw()
+        self.display.present(cheap=self.quality.tier.cheap_present)
+        self.map_manager.draw_sign(self.screen)
+        self.dialog_box.render(self.screen)
+
+        if not self.game_started:
+            self.start_menu.update()
+            self.start_menu.draw(self.screen)
+
+        if self.recorder:
+            self.recorder.capture()
+
+        pygame.display.flip()
+        return running
+
     def run(self):
 
         clock = pygame.time.Clock()
@@ -51,35 +146,11 @@ class Game:
         self.timer_start = pygame.time.get_ticks()
         running = True
         while running:
-            events = pygame.event.get()
-            for event in events:
-                if event.type == pygame.QUIT:
-                    running = False
-                elif event.type == pygame.KEYUP:
-                    if event.key == pygame.K_SPACE:
-                        if self.map_manager.endgame is False:
-                            self.map_manager.check_npc_collisions(self.dialog_box)
-                            self.map_manager.check_interaction_collisions()
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_SPACE:
-                        if self.dialog_box.input_box.active is False and self.map_manager.endgame is False:
-                            self.space_sound.play()
-
-            self.player.save_location()
-            if self.game_started:
-                if self.dialog_box.reading:
-                    self.dialog_box.handle_input(events)
-                elif not self.map_manager.sign_active:
-                    self.handle_input()
-            self.update()
-            self.map_manager.draw()
-            self.dialog_box.render(self.screen)
-
-            if not self.game_started:
-                self.start_menu.update()
-                self.start_menu.draw(self.screen)
-
-            pygame.display.flip()
+            running = self.step(pygame.event.get())
             dt = clock.tick(60)
+            # temps de travail de la frame, sans l'attente de clock.tick
+            self.quality.record(clock.get_rawtime())
 
+        if self.recorder:
+            self.recorder.stop(wait=True)
         pygame.quit()
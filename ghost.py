@@ -0,0 +1,256 @@
+import os
+import struct
+from player import Entity
+
+MAGIC = b'ERGH'
+# un bloc commence par une position absolue ; le chercher suffit pour se placer sur un tick
+BLOCK_TICKS = 256
+
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def unzigzag(value):
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+class TrajectoryWriter:
+    """Écrit la trajectoire d'une partie, un enregistrement par tick.
+
+    Format : en-tête, puis blocs de BLOCK_TICKS ticks. Chaque bloc commence
+    par une position absolue, suivie de séries (nombre de ticks, dx, dy,
+    statut, monde) : un joueur qui marche tout droit ou reste immobile ne
+    coûte que quelques octets. La table des offsets des blocs est écrite à
+    la fin du fichier.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC + struct.pack('<IIQ', BLOCK_TICKS, 0, 0))
+        self.worlds = []
+        self.statuses = []
+        self.block_offsets = []
+        self.block = bytearray()
+        self.ticks = 0
+        self.last = None  # (monde, x, y, statut)
+        self.run = None  # [nombre, dx, dy, statut, monde]
+
+    def record(self, world, position, status):
+        if world not in self.worlds:
+            self.worlds.append(world)
+        if status not in self.statuses:
+            self.statuses.append(status)
+        state = (self.worlds.index(world), round(position[0]), round(position[1]), self.statuses.index(status))
+
+        if self.ticks % BLOCK_TICKS == 0:
+            self.flush_block()
+            self.block_offsets.append(self.file.tell())
+            self.block += struct.pack('<Biih', state[0], state[1], state[2], state[3])
+        else:
+            step = [state[1] - self.last[1], state[2] - self.last[2], state[3], state[0]]
+            if self.run and self.run[1:] == step:
+                self.run[0] += 1
+            else:
+                self.flush_run()
+                self.run = [1] + step
+
+        self.last = state
+        self.ticks += 1
+
+    def flush_run(self):
+        if self.run:
+            count, dx, dy, status, world = self.run
+            write_varint(self.block, count)
+            write_varint(self.block, zigzag(dx))
+            write_varint(self.block, zigzag(dy))
+            self.block += bytes((status, world))
+            self.run = None
+
+    def flush_block(self):
+        self.flush_run()
+        self.file.write(self.block)
+        self.block = bytearray()
+
+    def close(self, duration_ms):
+        self.flush_block()
+        table = self.file.tell()
+        for names in (self.worlds, self.statuses):
+            self.file.write(struct.pack('<H', len(names)))
+            for name in names:
+                name = name.encode()
+                self.file.write(struct.pack('<B', len(name)) + name)
+        self.file.write(struct.pack(f'<I{len(self.block_offsets)}I', len(self.block_offsets), *self.block_offsets))
+
+        self.file.seek(len(MAGIC))
+        self.file.write(struct.pack('<IIQ', BLOCK_TICKS, duration_ms, table))
+        self.file.close()
+
+
+class TrajectoryReader:
+    """Relit une trajectoire depuis le fichier, bloc par bloc.
+
+    Seule la table des blocs est gardée en mémoire : aller à un tick revient
+    à lire le bloc qui le contient, donc un coût constant quelle que soit la
+    durée de la partie.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        magic, header = self.file.read(4), self.file.read(16)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a ghost file')
+        self.block_ticks, self.duration_ms, table = struct.unpack('<IIQ', header)
+
+        self.file.seek(table)
+        self.worlds = self.read_names()
+        self.statuses = self.read_names()
+        count = struct.unpack('<I', self.file.read(4))[0]
+        self.block_offsets = list(struct.unpack(f'<{count}I', self.file.read(4 * count)))
+        self.block_offsets.append(table)
+
+        self.block_index = None
+        self.states = []
+
+    def read_names(self):
+        names = []
+        for _ in range(struct.unpack('<H', self.file.read(2))[0]):
+            length = self.file.read(1)[0]
+            names.append(self.file.read(length).decode())
+        return names
+
+    def load_block(self, index):
+        start, end = self.block_offsets[index], self.block_offsets[index + 1]
+        self.file.seek(start)
+        data = self.file.read(end - start)
+
+        world, x, y, status = struct.unpack_from('<Biih', data)
+        states = [(world, x, y, status)]
+        pos = struct.calcsize('<Biih')
+        while pos < len(data):
+            count, pos = read_varint(data, pos)
+            dx, pos = read_varint(data, pos)
+            dy, pos = read_varint(data, pos)
+            dx, dy = unzigzag(dx), unzigzag(dy)
+            status, world = data[pos], data[pos + 1]
+            pos += 2
+            for _ in range(count):
+                x += dx
+                y += dy
+                states.append((world, x, y, status))
+
+        self.block_index = index
+        self.states = states
+
+    def at(self, tick):
+        """(monde, x, y, statut) au tick donné, ou None après la fin de la partie."""
+        index = tick // self.block_ticks
+        if index >= len(self.block_offsets) - 1:
+            return None
+        if index != self.block_index:
+            self.load_block(index)
+        offset = tick % self.block_ticks
+        if offset >= len(self.states):
+            return None
+        world, x, y, status = self.states[offset]
+        return self.worlds[world], x, y, self.statuses[status]
+
+    def close(self):
+        self.file.close()
+
+
+class Ghost(Entity):
+    """Le meilleur temps, rejoué en transparence à côté du joueur."""
+
+    def __init__(self, reader):
+        super().__init__("skeleton", 0, 0)
+        self.reader = reader
+        self.world = None
+
+    def replay(self, tick):
+        state = self.reader.at(tick)
+        if state is None:
+            self.world = None
+            return
+
+        self.world, x, y, self.status = state
+        self.direction = self.status.split('_')[1]
+        self.position = [x, y]
+        self.update_rect()
+
+    def update(self):
+        self.animate()
+        self.image.set_alpha(110)
+
+
+class GhostRuns:
+    """Enregistre chaque partie et rejoue la meilleure sous forme de fantôme."""
+
+    def __init__(self, map_manager, folder='../data/ghosts'):
+        self.map_manager = map_manager
+        self.folder = folder
+        self.best_path = os.path.join(folder, 'best.ghost')
+        self.current_path = os.path.join(folder, 'current.ghost')
+        self.writer = None
+        self.ghost = None
+        self.tick = 0
+
+    def start(self):
+        os.makedirs(self.folder, exist_ok=True)
+        self.writer = TrajectoryWriter(self.current_path)
+        self.tick = 0
+        if os.path.exists(self.best_path):
+            self.ghost = Ghost(TrajectoryReader(self.best_path))
+
+    def finish(self, duration_ms):
+        self.writer.close(duration_ms)
+        self.writer = None
+        self.hide_ghost()
+        if self.ghost:
+            best_ms = self.ghost.reader.duration_ms
+            self.ghost.reader.close()
+            self.ghost = None
+            if best_ms <= duration_ms:
+                return
+        os.replace(self.current_path, self.best_path)
+
+    def hide_ghost(self):
+        if self.ghost:
+            self.ghost.kill()
+
+    def update(self):
+        if self.writer is None:
+            return
+
+        player = self.map_manager.player
+        self.writer.record(self.map_manager.current_map, player.position, player.status)
+
+        if self.ghost:
+            self.ghost.replay(self.tick)
+            group = self.map_manager.get_group()
+            if self.ghost.world == self.map_manager.current_map and self.map_manager.quality.tier.overlays:
+                if self.ghost not in group:
+                    self.hide_ghost()
+                    group.add(self.ghost)
+            else:
+                self.hide_ghost()
+        self.tick += 1
@@ -0,0 +1,66 @@
+import logging
+import os
+import xml.etree.ElementTree as ElementTree
+import pygame
+
+logger = logging.getLogger(__name__)
+
+# ce qu'une carte à moitié enregistrée (ou invalide) peut lever au chargement
+RELOAD_ERRORS = (ElementTree.ParseError, OSError, KeyError, ValueError)
+
+
+class MapWatcher:
+    """Surveille les fichiers .tmx et les tilesets .tsx qu'ils utilisent (mode développeur).
+
+    Chaque appel à poll renvoie le nom des cartes à recharger : une carte
+    modifiée, ou toutes les cartes qui utilisent un tileset modifié. Les
+    dates de modification d'une carte ne sont mises à jour qu'une fois la
+    carte rechargée (loaded) : tant que le chargement échoue, elle est
+    proposée à nouveau à chaque poll.
+    """
+
+    def __init__(self, names, folder='../data/tmx', interval=500):
+        self.folder = folder
+        self.interval = interval
+        self.last_poll = pygame.time.get_ticks()
+        self.files = {}  # nom de la carte -> {chemin du .tmx ou d'un .tsx: date de modification}
+
+        for name in names:
+            self.loaded(name)
+
+    def map_path(self, name):
+        return os.path.normpath(os.path.join(self.folder, f'{name}.tmx'))
+
+    def loaded(self, name):
+        # la carte vient d'être chargée : ses fichiers actuels servent de référence
+        path = self.map_path(name)
+        try:
+            files = {path: os.path.getmtime(path)}
+            for _, node in ElementTree.iterparse(path):
+                if node.tag == 'tileset' and node.get('source'):
+                    tileset = os.path.normpath(os.path.join(os.path.dirname(path), node.get('source')))
+                    files[tileset] = os.path.getmtime(tileset)
+        except RELOAD_ERRORS as error:
+            # réécrite entre temps : les anciennes dates font recharger la carte au prochain poll
+            logger.warning('suivi de %s impossible : %s', name, error)
+            return
+        self.files[name] = files
+
+    def poll(self):
+        now = pygame.time.get_ticks()
+        if now - self.last_poll < self.interval:
+            return set()
+        self.last_poll = now
+
+        changed = set()
+        for name, files in self.files.items():
+            for path, mtime in files.items():
+                try:
+                    new_mtime = os.path.getmtime(path)
+                except OSError:
+                    # fichier en cours d'écriture par l'éditeur
+                    continue
+                if new_mtime != mtime:
+                    changed.add(name)
+                    break
+        return changed
@@ -1,10 +1,20 @@
 from dataclasses import dataclass
+import logging
 import random
 import pygame
 import pytmx
 import pyscroll
 from player import NPC, Boss, LightsGuy, DiskGiver
 from dialog import Sign
+from atlas import assets
+from collision import WallGrid, sweep
+from display import NATIVE_SIZE
+from hot_reload import RELOAD_ERRORS
+from minimap import Minimap
+from streaming import ChunkStreamer, StreamedMapData, StreamedTmx, is_infinite
+from tile_animation import AnimatedMapData
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -25,17 +35,30 @@ class Map:
     npcs: list[NPC]
     interactions: list
     music_name: str
+    streamer: ChunkStreamer = None
+    wall_grid: WallGrid = None
+
+    def __post_init__(self):
+        self.wall_grid = WallGrid(self.walls)
 
 
 class MapManager:
 
-    def __init__(self, screen, player, end_timer):
+    def __init__(self, screen, player, end_timer, quality):
         self.maps = dict()  # "house" -> Map("house", walls, group)
+        self.map_specs = dict()  # "house" -> arguments de register_map, pour le rechargement
         self.screen = screen
         self.player = player
         self.current_map = "Spawn"
         self.end_timer = end_timer
 
+        # niveau de qualité choisi selon le temps des frames
+        self.quality = quality
+        self.frame = 0
+
+        # facteur entre la surface de rendu et la taille native (1 en low-res, 2 sinon)
+        self.zoom = self.screen.get_width() // NATIVE_SIZE[0]
+
         # Lights in level 1
         self.lights_on = True
         self.lightswitch_time = pygame.time.get_ticks()
@@ -45,37 +68,52 @@ class MapManager:
         self.chimney_sound.set_volume(0.05)
 
         # player inventory display:
-        self.cd1 = pygame.image.load('../graphics/Tools/Morceau de CD.png').convert_alpha()
+        self.cd1 = assets.load('../graphics/Tools/Morceau de CD.png').convert_alpha()
         self.cd1.set_colorkey((0, 0, 0))
-        self.cd2 = pygame.image.load('../graphics/Tools/Morceau de CD2.png').convert_alpha()
+        self.cd2 = assets.load('../graphics/Tools/Morceau de CD2.png').convert_alpha()
         self.cd2.set_colorkey((0, 0, 0))
-        self.cd3 = pygame.image.load('../graphics/Tools/Morceau de CD3.png').convert_alpha()
+        self.cd3 = assets.load('../graphics/Tools/Morceau de CD3.png').convert_alpha()
         self.cd3.set_colorkey((0, 0, 0))
-        self.cd4 = pygame.image.load('../graphics/Tools/Morceau de CD4.png').convert_alpha()
+        self.cd4 = assets.load('../graphics/Tools/Morceau de CD4.png').convert_alpha()
         self.cd4.set_colorkey((0, 0, 0))
         self.cd_parts = [self.cd1, self.cd2, self.cd3, self.cd4]
-        w = 32
+        w = 16 * self.zoom
         for index, image in enumerate(self.cd_parts):
             self.cd_parts[index] = pygame.transform.scale(image, (w, w))
-        xoffset = 10
-        yoffset = 5
-        screen_w = 480
+        xoffset = 5 * self.zoom
+        yoffset = 5 * self.zoom // 2
+        screen_w = self.screen.get_width()
         self.cd1pos = (screen_w - xoffset - w / 2, yoffset)
         self.cd2pos = (self.cd1pos[0] - xoffset - w, yoffset)
         self.cd3pos = (self.cd2pos[0] - xoffset - w / 2, yoffset - w / 4)
         self.cd4pos = (self.cd3pos[0] - xoffset - w / 4, self.cd3pos[1])
 
+        # le HUD des morceaux de CD est recomposé seulement quand l'inventaire change
+        cd_rects = [pygame.Rect(pos, (w, w)) for pos in (self.cd1pos, self.cd2pos, self.cd3pos, self.cd4pos)]
+        self.cd_hud_rect = cd_rects[0].unionall(cd_rects[1:])
+        self.cd_hud = pygame.Surface(self.cd_hud_rect.size, pygame.SRCALPHA)
+        self.cd_hud_visible = False
+        self.state = self.player.state
+        self.cd_mask = self.state.mask(['cd1', 'cd2', 'cd3', 'cd4'])
+        self.state.subscribe('items', self.update_cd_hud)
+        self.state.subscribe('items', self.update_mission)
+
         # Endgame
         self.endgame = False
         self.endgame_time = 0
-        self.endgame_image = pygame.image.load('../graphics/labo/endgame_image.jpg')
-        self.endgame_image = pygame.transform.scale(self.endgame_image, (480, 480))
+        self.endgame_image = assets.load('../graphics/labo/endgame_image.jpg')
+        self.endgame_image = pygame.transform.scale(self.endgame_image, self.screen.get_size())
         self.endgame_sound = pygame.mixer.Sound('../audio/music/MEDLEY.mp3')
         self.endgame_sound.set_volume(0.1)
 
         self.sign = None
         self.sign_active = False
 
+        # minimap et vue d'ensemble des mondes
+        self.minimap = Minimap(self)
+        self.show_minimap = False
+        self.show_overview = False
+
         self.register_map('Spawn',
                           portals=[
                               Portal(from_world="Spawn", origin_point="passage_spawn_entry",
@@ -377,7 +415,7 @@ class MapManager:
         self.cd_sound = pygame.mixer.Sound('../audio/sfx/BROKENCDSOUND.mp3')
 
     def reset_game(self):
-        self.player.inventory = []
+        self.state.reset()
         self.current_map = "Spawn"
         self.music.stop()
         self.endgame_sound.stop()
@@ -386,16 +424,30 @@ class MapManager:
         self.music.set_volume(0.1)
         self.music.play(loops=-1)
         self.teleport_player("player")
-        self.player.lights_on = False
         self.endgame = False
         self.endgame_time = 0
 
+    def start_endgame(self):
+        self.music.stop()
+        self.endgame_sound.play()
+        self.endgame_time = pygame.time.get_ticks()
+        self.endgame = True
+
+    def take_portal(self, portal):
+        self.current_map = portal.target_world
+        if self.maps[self.current_map].music_name != self.music_name:
+            self.music_name = self.maps[self.current_map].music_name
+            self.music.stop()
+            self.music = self.music_dict[self.maps[self.current_map].music_name]
+            self.music.set_volume(0.07)
+            self.music.play(loops=-1)
+        self.teleport_player(portal.teleport_point)
+
+    def update_mission(self, state):
+        state.set_flag('mission_complete', state.has_all(self.cd_mask))
+
     def check_cd(self):
-        inventory = self.player.inventory
-        if 'cd1' in inventory and 'cd2' in inventory and 'cd3' in inventory and 'cd4' in inventory:
-            return True
-        else:
-            return False
+        return self.state.flag('mission_complete')
 
     def read_sign(self):
         self.sign = Sign(text='    ?')
@@ -416,24 +468,20 @@ class MapManager:
                     if mission_complete:
                         # Lorsque le dialogue est terminé, on lance le son et on affiche l'image
                         if dialog_box.text_index == len(dialog_box.texts) - 1 and dialog_box.main_dialog_index == 0:
-                            self.music.stop()
-                            self.endgame_sound.play()
-                            self.endgame_time = pygame.time.get_ticks()
-                            self.endgame = True
+                            self.start_endgame()
 
                         if dialog_box.text_index == 9 and dialog_box.main_dialog_index == 0:
                             self.cd_sound.play()
 
                 elif type(sprite) is LightsGuy:
 
-                    mission_complete = self.player.lights_on
+                    mission_complete = self.state.flag('lights_on')
                     dialog = sprite.get_dialog(mission_complete=mission_complete)
 
                     # Lorsque le dialogue est terminé et si la mission est accompli, on donne un disque au joueur
                     if dialog_box.text_index == len(dialog_box.texts) - 1:
                         if mission_complete:
-                            if 'cd1' not in self.player.inventory:
-                                self.player.inventory.append('cd1')
+                            self.state.give('cd1')
 
                 elif type(sprite) is DiskGiver:
 
@@ -441,9 +489,7 @@ class MapManager:
 
                     # Lorsque le dialogue est terminé, on donne un disque au joueur
                     if dialog_box.text_index == len(dialog_box.texts) - 1:
-                        disk = sprite.reward
-                        if disk not in self.player.inventory:
-                            self.player.inventory.append(disk)
+                        self.state.give(sprite.reward)
 
                 dialog_box.execute(dialog)
 
@@ -454,7 +500,7 @@ class MapManager:
             if self.player.rect.colliderect(obj_rect):
                 # Level 1 lightswich:
                 if obj.name == 'turnlight_on':
-                    self.player.lights_on = True
+                    self.state.set_flag('lights_on')
                     self.chimney_sound.play()
 
                 # Panneau:
@@ -472,16 +518,9 @@ class MapManager:
                 rect = pygame.Rect(point.x, point.y, point.width, point.height)
 
                 if self.player.feet.colliderect(rect):
-                    self.current_map = portal.target_world
-                    if self.maps[self.current_map].music_name != self.music_name:
-                        self.music_name = self.maps[self.current_map].music_name
-                        self.music.stop()
-                        self.music = self.music_dict[self.maps[self.current_map].music_name]
-                        self.music.set_volume(0.07)
-                        self.music.play(loops=-1)
-                    self.teleport_player(portal.teleport_point)
-
-        # collision
+                    self.take_portal(portal)
+
+        # npcs arrêtés au contact du joueur
         for sprite in self.get_group().sprites():
 
             if isinstance(sprite, NPC):
@@ -491,8 +530,14 @@ class MapManager:
                 else:
                     sprite.speed = 0.5
 
-            if sprite.feet.collidelist(self.get_walls()) > -1:
-                sprite.move_back()
+    def resolve_movements(self, sprites):
+        # chaque déplacement est raccourci avant d'être appliqué, axe par axe, contre les murs proches
+        wall_grid = self.get_map().wall_grid
+        for sprite in sprites:
+            if sprite.vel != [0, 0]:
+                sprite.update_rect()
+                dx, dy, _ = sweep(sprite.feet, sprite.vel[0], sprite.vel[1], wall_grid)
+                sprite.vel = [dx, dy]
 
     def teleport_player(self, name):
         point = self.get_object(name)
@@ -500,13 +545,22 @@ class MapManager:
         self.player.position[1] = point.y
         self.player.save_location()
 
-    def register_map(self, name, music_name, portals=[], npcs=[]):
+    def register_map(self, name, music_name, portals=[], npcs=[], streamed=False):
+
+        self.map_specs[name] = (music_name, portals, npcs, streamed)
+        self.maps[name] = self.load_map(name, music_name, portals, npcs, streamed)
+
+    def load_map(self, name, music_name, portals, npcs, streamed):
 
-        # charger la carte tmx
-        tmx_data = pytmx.util_pygame.load_pygame(f'../data/tmx/{name}.tmx')
-        map_data = pyscroll.data.TiledMapData(tmx_data)
+        filename = f'../data/tmx/{name}.tmx'
+        if streamed or is_infinite(filename):
+            return self.load_streamed_map(name, filename, music_name, portals, npcs)
+
+        # charger la carte tmx (images des tilesets lues depuis l'archive d'assets si elle existe)
+        tmx_data = pytmx.TiledMap(filename, image_loader=assets.tmx_image_loader)
+        map_data = AnimatedMapData(tmx_data)
         map_layer = pyscroll.orthographic.BufferedRenderer(map_data, self.screen.get_size())
-        map_layer.zoom = 2
+        map_layer.zoom = self.zoom
 
         # definir une liste qui stocke les rect de collision
 
@@ -529,7 +583,82 @@ class MapManager:
             group.add(npc)
 
         # creer la map
-        self.maps[name] = Map(name, walls, group, tmx_data, portals, npcs, interactions, music_name)
+        return Map(name, walls, group, tmx_data, portals, npcs, interactions, music_name)
+
+    def load_streamed_map(self, name, filename, music_name, portals, npcs):
+
+        # grande carte (ou carte infinie) : seuls les chunks autour du joueur sont chargés
+        tmx_data = StreamedTmx(filename)
+        streamer = ChunkStreamer(tmx_data)
+        map_data = StreamedMapData(streamer)
+        map_layer = pyscroll.orthographic.BufferedRenderer(map_data, self.screen.get_size())
+        map_layer.zoom = self.zoom
+        streamer.map_layer = map_layer
+
+        # les murs et interactions sont remplis au fur et à mesure du chargement des chunks
+        group = pyscroll.PyscrollGroup(map_layer=map_layer, default_layer=10)
+        group.add(self.player)
+
+        return Map(name, [], group, tmx_data, portals, npcs, [], music_name, streamer)
+
+    def stream_chunks(self):
+        map = self.get_map()
+        if map.streamer is None:
+            return
+
+        if map.streamer.update(self.player.rect.center, self.player.vel):
+            map.walls[:] = map.streamer.walls()
+            map.wall_grid = WallGrid(map.walls)
+            map.interactions[:] = map.streamer.interactions()
+
+            # seuls les npcs proches du joueur sont mis à jour et dessinés
+            for npc in map.npcs:
+                if map.streamer.is_resident(npc.position):
+                    map.group.add(npc)
+                else:
+                    map.group.remove(npc)
+
+    def reload_map(self, name):
+        """Recharge une carte modifiée, renvoie False si elle n'a pas pu être lue.
+
+        Tiled n'écrit pas ses fichiers d'un coup : une carte à moitié
+        enregistrée ou invalide est ignorée, et l'ancienne reste en place.
+        """
+        old_map = self.maps[name]
+        music_name, portals, npcs, streamed = self.map_specs[name]
+
+        new_map = None
+        try:
+            new_map = self.load_map(name, music_name, portals, npcs, streamed)
+            # les chemins des npcs ont pu bouger dans la carte
+            paths = [npc.path_points(new_map.tmx_data) for npc in npcs]
+        except RELOAD_ERRORS as error:
+            logger.warning('rechargement de %s impossible, la carte actuelle est gardée : %s', name, error)
+            if new_map is not None:
+                self.discard_map(new_map)
+            return False
+
+        # detacher le joueur et les npcs de l'ancien groupe avant de le remplacer
+        self.discard_map(old_map)
+        self.maps[name] = new_map
+        self.minimap.forget(name)
+
+        for npc, points in zip(npcs, paths):
+            npc.points = points
+            npc.current_point = 0
+            npc.teleport_spawn()
+
+        # le joueur garde sa position si il est dans la carte rechargée
+        if name == self.current_map:
+            self.player.update_rect()
+            self.get_group().center(self.player.rect.center)
+        return True
+
+    @staticmethod
+    def discard_map(map):
+        map.group.empty()
+        if map.streamer is not None:
+            map.streamer.stop()
 
     def get_map(self):
         return self.maps[self.current_map]
@@ -567,37 +696,69 @@ class MapManager:
                 self.lights_on = True
                 self.lightswitch_sound.play()
 
-    def display_cd(self, screen):
-        inv = self.player.inventory
+    def update_cd_hud(self, state):
+        self.cd_hud.fill((0, 0, 0, 0))
+        self.cd_hud_visible = False
+        positions = (self.cd1pos, self.cd2pos, self.cd3pos, self.cd4pos)
+        for item, image, pos in zip(('cd1', 'cd2', 'cd3', 'cd4'), self.cd_parts, positions):
+            if state.has(item):
+                self.cd_hud.blit(image, (pos[0] - self.cd_hud_rect.x, pos[1] - self.cd_hud_rect.y))
+                self.cd_hud_visible = True
 
-        if 'cd1' in inv:
-            screen.blit(self.cd_parts[0], self.cd1pos)
-        if 'cd2' in inv:
-            screen.blit(self.cd_parts[1], self.cd2pos)
-        if 'cd3' in inv:
-            screen.blit(self.cd_parts[2], self.cd3pos)
-        if 'cd4' in inv:
-            screen.blit(self.cd_parts[3], self.cd4pos)
+    def display_cd(self, screen):
+        if self.cd_hud_visible:
+            screen.blit(self.cd_hud, self.cd_hud_rect)
 
     def draw(self):
         self.get_group().draw(self.screen)
         self.get_group().center(self.player.rect.center)
 
         if self.get_map().name == 'First_Level':
-            if not self.player.lights_on:
+            if not self.state.flag('lights_on'):
                 self.blinking_lights()
 
         self.display_cd(self.screen)
 
-        if self.sign_active:
-            self.sign.draw(self.screen)
+        if self.quality.tier.overlays:
+            if self.show_overview:
+                self.minimap.draw_overview(self.screen)
+            elif self.show_minimap:
+                self.minimap.draw(self.screen, self.get_map(), self.player)
 
         if self.endgame:
             self.screen.blit(self.endgame_image, (0, 0))
 
+    def draw_sign(self, screen):
+        # le panneau est dessiné à la résolution de la fenêtre, comme les dialogues
+        if self.sign_active:
+            self.sign.draw(screen)
+
+    def update_sprites(self):
+        tier = self.quality.tier
+        self.frame += 1
+        view = self.get_group().view
+
+        # les npcs hors de l'écran peuvent être mis à jour moins souvent, avec un pas plus grand
+        sprites = []
+        for sprite in self.get_group().sprites():
+            if isinstance(sprite, NPC) and not sprite.rect.colliderect(view):
+                if self.frame % tier.offscreen_interval:
+                    continue
+                sprite.vel = [v * tier.offscreen_interval for v in sprite.vel]
+            sprites.append(sprite)
+
+        self.resolve_movements(sprites)
+
+        for sprite in sprites:
+            if isinstance(sprite, NPC) and self.frame % tier.npc_animation_step:
+                sprite.update_status()
+                sprite.update_position()
+            else:
+                sprite.update()
 
     def update(self):
-        self.get_group().update()
+        self.stream_chunks()
+        self.update_sprites()
         self.check_collisions()
 
         for npc in self.get_map().npcs:
@@ -0,0 +1,171 @@
+import glob
+import hashlib
+import math
+import os
+import pygame
+from atlas import tileset_files
+from streaming import CHUNK_SIZE, TileImages
+
+
+class Minimap:
+    """Miniatures des mondes et vue d'ensemble des portails.
+
+    Chaque miniature est rendue une seule fois à partir des calques de tuiles,
+    avec les murs et les portails par-dessus, puis mise en cache sur le disque
+    sous le hash du fichier tmx, de ses tilesets et de leurs images. À l'écran, il ne reste qu'un blit par frame
+    plus le marqueur du joueur.
+    """
+
+    def __init__(self, map_manager, size=48, cache_folder='../data/minimap'):
+        self.map_manager = map_manager
+        self.size = size * map_manager.zoom
+        self.cache_folder = cache_folder
+        self.thumbnails = {}  # nom -> (surface, échelle en px par pixel du monde)
+        self.overview = None
+        self.colors = {}  # couleur moyenne par image de tuile
+
+    def forget(self, name):
+        # appelé quand une carte est rechargée
+        self.thumbnails.pop(name, None)
+        self.overview = None
+
+    def get_thumbnail(self, map):
+        if map.name not in self.thumbnails:
+            tilewidth = map.tmx_data.tilewidth
+            width, height = self.map_size(map)
+
+            path = os.path.join(self.cache_folder, f'{map.name}-{self.digest(map.name)}-{self.size}.png')
+
+            if os.path.exists(path):
+                surface = pygame.image.load(path).convert()
+            else:
+                surface = self.render(map, width, height)
+                os.makedirs(self.cache_folder, exist_ok=True)
+                # les miniatures d'anciennes versions de la carte ne resserviront pas
+                pattern = glob.escape(map.name) + '-' + '[0-9a-f]' * 16 + '-*.png'
+                for old in glob.glob(os.path.join(self.cache_folder, pattern)):
+                    os.remove(old)
+                pygame.image.save(surface, path)
+
+            scale = surface.get_width() / (width * tilewidth)
+            self.thumbnails[map.name] = (surface, scale)
+
+        return self.thumbnails[map.name]
+
+    @staticmethod
+    def digest(name):
+        # les couleurs viennent des tilesets : les modifier doit aussi changer la clé
+        filename = f'../data/tmx/{name}.tmx'
+        sha = hashlib.sha1()
+        for path in [filename] + tileset_files(filename):
+            with open(path, 'rb') as file:
+                sha.update(file.read())
+        return sha.hexdigest()[:16]
+
+    @staticmethod
+    def map_size(map):
+        if map.streamer is not None:
+            return map.tmx_data.size
+        return map.tmx_data.width, map.tmx_data.height
+
+    def tiles(self, map):
+        # (x, y, image) pour chaque tuile visible, carte streamée ou non
+        if map.streamer is None:
+            for layer in map.tmx_data.visible_tile_layers:
+                yield from map.tmx_data.layers[layer].tiles()
+            return
+
+        tmx = map.tmx_data
+        images = TileImages(tmx)
+        for key in tmx.packed:
+            chunk = tmx.load_chunk(key)
+            for gids in chunk.layers:
+                if gids is None:
+                    continue
+                for index, gid in enumerate(gids):
+                    if gid:
+                        yield (key[0] * CHUNK_SIZE + index % CHUNK_SIZE, key[1] * CHUNK_SIZE + index // CHUNK_SIZE,
+                               images.get(gid))
+
+    def render(self, map, width, height):
+        # une tuile = un pixel de sa couleur moyenne, puis mise à l'échelle une seule fois
+        surface = pygame.Surface((width, height)).convert()
+        for x, y, image in self.tiles(map):
+            if image is None:
+                continue
+            if image not in self.colors:
+                self.colors[image] = pygame.transform.average_color(image)
+            surface.set_at((x, y), self.colors[image])
+
+        ratio = self.size / max(width, height)
+        thumbnail = pygame.transform.scale(surface, (max(1, int(width * ratio)), max(1, int(height * ratio))))
+        scale = thumbnail.get_width() / (width * map.tmx_data.tilewidth)
+
+        for wall in self.collision_rects(map):
+            rect = pygame.Rect(wall.x * scale, wall.y * scale, max(1, wall.width * scale), max(1, wall.height * scale))
+            thumbnail.fill((120, 30, 30), rect)
+
+        for portal in map.portals:
+            point = map.tmx_data.get_object_by_name(portal.origin_point)
+            rect = pygame.Rect(point.x * scale, point.y * scale, max(2, point.width * scale), max(2, point.height * scale))
+            thumbnail.fill((240, 200, 40), rect)
+
+        return thumbnail
+
+    @staticmethod
+    def collision_rects(map):
+        if map.streamer is None:
+            return map.walls
+        # une carte streamée n'a que les murs des chunks chargés, on prend ceux de l'index
+        walls = {}
+        for objects in map.tmx_data.objects.values():
+            for obj in objects:
+                if obj.type == 'collision':
+                    walls[obj.id] = obj
+        return walls.values()
+
+    def draw(self, screen, map, player):
+        surface, scale = self.get_thumbnail(map)
+        offset = 4 * self.map_manager.zoom
+        screen.blit(surface, (offset, offset))
+
+        x = offset + player.rect.centerx * scale
+        y = offset + player.rect.centery * scale
+        pygame.draw.rect(screen, (255, 255, 255), (x - 1, y - 1, 3, 3))
+
+    def get_overview(self):
+        if self.overview is None:
+            self.overview = self.render_overview()
+        return self.overview
+
+    def render_overview(self):
+        # graphe des mondes : une miniature par monde, un trait par portail
+        maps = self.map_manager.maps
+        screen_w, screen_h = self.map_manager.screen.get_size()
+        surface = pygame.Surface((screen_w, screen_h)).convert()
+        surface.fill((10, 10, 20))
+
+        radius = min(screen_w, screen_h) // 2 - self.size // 2
+        positions = {}
+        for index, name in enumerate(maps):
+            angle = 2 * math.pi * index / len(maps)
+            positions[name] = (screen_w // 2 + int(radius * math.cos(angle)),
+                               screen_h // 2 + int(radius * math.sin(angle)))
+
+        for map in maps.values():
+            for portal in map.portals:
+                if portal.target_world in positions:
+                    pygame.draw.line(surface, (240, 200, 40), positions[portal.from_world],
+                                     positions[portal.target_world])
+
+        for name, map in maps.items():
+            thumbnail = self.get_thumbnail(map)[0]
+            ratio = self.size / 2 / max(thumbnail.get_size())
+            thumbnail = pygame.transform.scale(thumbnail, (max(1, int(thumbnail.get_width() * ratio)),
+                                                           max(1, int(thumbnail.get_height() * ratio))))
+            surface.blit(thumbnail, thumbnail.get_rect(center=positions[name]))
+
+        return surface
+
+    def draw_overview(self, screen):
+        screen.blit(self.get_overview(), (0, 0))
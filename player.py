@@ -1,5 +1,6 @@
 import pygame
 from animation import AnimateSprite
+from state import GameState
 
 
 class Entity(AnimateSprite):
@@ -31,9 +32,12 @@ class Entity(AnimateSprite):
         self.save_location()
         self.position[0] += self.vel[0]
         self.position[1] += self.vel[1]
+        self.update_rect()
+        self.vel = [0, 0]
+
+    def update_rect(self):
         self.rect.topleft = self.position
         self.feet.midbottom = self.rect.midbottom
-        self.vel = [0, 0]
 
     def move_up(self):
         self.vel = [0, -self.speed]
@@ -51,11 +55,6 @@ class Entity(AnimateSprite):
         self.vel = [-self.speed, 0]
         self.direction = 'left'
 
-    def move_back(self):
-        self.position = self.old_position
-        self.rect.topleft = self.position
-        self.feet.midbottom = self.rect.midbottom
-
     def update(self):
         self.animate()
         self.update_status()
@@ -66,8 +65,8 @@ class Player(Entity):
 
     def __init__(self):
         super().__init__("skeleton", 0, 0)
-        self.inventory = []
-        self.lights_on = False
+        # objets ramassés et avancement des quêtes
+        self.state = GameState()
         self.speed = 2
         self.walk_sound = pygame.mixer.Sound('../audio/sfx/WALKSOUND.wav')
         self.walk_sound.set_volume(0.4)
@@ -124,10 +123,15 @@ class NPC(Entity):
         self.save_location()
 
     def load_points(self, tmx_data):
+        self.points.extend(self.path_points(tmx_data))
+
+    def path_points(self, tmx_data):
+        points = []
         for num in range(1, self.nb_points + 1):
             point = tmx_data.get_object_by_name(f"{self.name}_path{num}")
             rect = pygame.Rect(point.x, point.y, point.width, point.height)
-            self.points.append(rect)
+            points.append(rect)
+        return points
 
     def get_dialog(self, **kwargs):
 
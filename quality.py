@@ -0,0 +1,67 @@
+from collections import deque
+from dataclasses import dataclass
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QualityTier:
+    name: str
+    npc_animation_step: int  # les npcs changent d'image une frame sur n
+    offscreen_interval: int  # les npcs hors de l'écran sont mis à jour une frame sur n
+    overlays: bool  # minimap, vue d'ensemble, fantôme
+    cheap_present: bool  # agrandissement au plus proche au lieu de scale2x
+
+
+TIERS = [
+    QualityTier('full', 1, 1, True, False),
+    QualityTier('npc_animation', 2, 1, True, False),
+    QualityTier('offscreen_updates', 2, 4, True, False),
+    QualityTier('no_overlays', 2, 4, False, False),
+    QualityTier('cheap_present', 2, 4, False, True),
+]
+
+
+class QualityGovernor:
+    """Baisse la qualité quand les frames dépassent le budget, la remonte quand il reste de la marge.
+
+    La décision porte sur le 90e centile des ``window`` dernières frames ;
+    après chaque changement, la fenêtre repart de zéro pour laisser le
+    nouveau niveau faire effet.
+    """
+
+    def __init__(self, budget_ms=1000 / 60, window=60, cheap_present=True):
+        self.budget_ms = budget_ms
+        self.frame_times = deque(maxlen=window)
+        self.level = 0
+        self.pinned = None
+        # sans framebuffer basse résolution, un niveau qui ne fait que changer l'agrandissement ne sert à rien
+        self.max_level = max(index for index, tier in enumerate(TIERS) if cheap_present or not tier.cheap_present)
+
+    @property
+    def tier(self):
+        return TIERS[self.level if self.pinned is None else self.pinned]
+
+    def record(self, frame_ms):
+        self.frame_times.append(frame_ms)
+        if self.pinned is not None or len(self.frame_times) < self.frame_times.maxlen:
+            return
+
+        slow = sorted(self.frame_times)[len(self.frame_times) * 9 // 10]
+        if slow > self.budget_ms and self.level < self.max_level:
+            self.set_level(self.level + 1, slow)
+        elif slow < self.budget_ms * 0.6 and self.level > 0:
+            self.set_level(self.level - 1, slow)
+
+    def set_level(self, level, slow):
+        logger.info('qualité : %s -> %s (90e centile %.1f ms, budget %.1f ms)',
+                    TIERS[self.level].name, TIERS[level].name, slow, self.budget_ms)
+        self.level = level
+        self.frame_times.clear()
+
+    def pin(self, level):
+        # None rend la main au réglage automatique
+        self.pinned = level
+        self.frame_times.clear()
+        logger.info('qualité fixée à %s', TIERS[level].name if level is not None else 'auto')
@@ -0,0 +1,276 @@
+"""Test d'endurance : enchaîne des parties complètes sans fenêtre ni son.
+
+Chaque cycle fait marcher le joueur au hasard de monde en monde, puis
+joue la quête avec les touches du jeu : il allume la cheminée, parle au
+gars des lumières et aux donneurs de disques, rend les morceaux au Boss
+et attend la fin du jeu jusqu'à ce que reset_game ramène le joueur au
+Spawn, comme sur une borne. Seuls les trajets d'un monde à l'autre (ou
+jusqu'à un npc) sont des téléportations. Après chaque cycle on relève la
+mémoire (RSS et tracemalloc, avec les plus fortes croissances depuis le
+cycle précédent), le nombre de surfaces pygame et de canaux audio
+occupés, et les centiles du temps de frame. Le test échoue si l'une de
+ces mesures augmente de cycle en cycle.
+
+Les fantômes sont écrits dans un dossier temporaire : le meilleur temps
+de la borne n'est pas touché.
+
+    python soak.py --cycles 50 --frames 2000
+
+Pour vérifier que le test sait encore voir une fuite, --leak-surfaces N
+garde N surfaces de plus à chaque cycle : il doit alors échouer.
+"""
+import argparse
+from collections import defaultdict
+import gc
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+
+MOVES = [pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT]
+# pages de dialogue au plus avant d'abandonner une conversation
+MAX_PAGES = 60
+
+
+def rss_kb():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        # pas de /proc : on se contente du pic
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def count_surfaces():
+    # les Surface ne sont pas suivies par le gc : on les cherche parmi les références des objets suivis
+    surfaces = set()
+    for obj in gc.get_objects():
+        for referent in gc.get_referents(obj):
+            if isinstance(referent, pygame.Surface):
+                surfaces.add(id(referent))
+    return len(surfaces)
+
+
+def busy_channels():
+    return sum(pygame.mixer.Channel(i).get_busy() for i in range(pygame.mixer.get_num_channels()))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def slope(values):
+    # pente de la droite des moindres carrés, par cycle
+    n = len(values)
+    mean_x = (n - 1) / 2
+    mean_y = sum(values) / n
+    num = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values))
+    den = sum((x - mean_x) ** 2 for x in range(n))
+    return num / den if den else 0
+
+
+def timed_step(game, frame_times, events=(), pressed=None):
+    start = time.perf_counter()
+    game.step(list(events), pressed if pressed is not None else defaultdict(bool))
+    frame_times.append((time.perf_counter() - start) * 1000)
+
+
+def press(game, frame_times, key):
+    # une frame touche enfoncée, une frame touche relâchée, comme au clavier
+    timed_step(game, frame_times, [pygame.event.Event(pygame.KEYDOWN, key=key, unicode='', mod=0, scancode=0)])
+    timed_step(game, frame_times, [pygame.event.Event(pygame.KEYUP, key=key, unicode='', mod=0, scancode=0)])
+
+
+def go_to(map_manager, world, position):
+    """Raccourci vers un point d'un monde : take_portal pour changer de monde, puis on place le joueur."""
+    if world != map_manager.current_map:
+        portal = next(portal for map in map_manager.maps.values() for portal in map.portals
+                      if portal.target_world == world)
+        map_manager.take_portal(portal)
+    player = map_manager.player
+    player.position[0], player.position[1] = position[0], position[1]
+    player.save_location()
+    player.update_rect()
+
+
+def find_npc(map_manager, kind):
+    for name, map in map_manager.maps.items():
+        for npc in map.npcs:
+            if type(npc) is kind:
+                yield name, npc
+
+
+def talk(game, frame_times, world, npc):
+    """Parle au npc avec ESPACE jusqu'à la fin du dialogue ; renvoie False si il ne se termine pas."""
+    dialog_box = game.dialog_box
+    started = False
+    for _ in range(MAX_PAGES):
+        go_to(game.map_manager, world, npc.position)
+        if dialog_box.input_box.active:
+            # question : on valide la réponse telle quelle
+            press(game, frame_times, pygame.K_RETURN)
+        else:
+            press(game, frame_times, pygame.K_SPACE)
+        if game.map_manager.endgame:
+            return True
+        if dialog_box.reading:
+            started = True
+        elif started:
+            return True
+    return False
+
+
+def play_quest(game, frame_times):
+    """La quête complète avec les touches du jeu ; renvoie le nombre d'étapes qu'il a fallu forcer."""
+    from player import Boss, DiskGiver, LightsGuy
+
+    map_manager = game.map_manager
+    state = map_manager.state
+    forced = 0
+
+    # cheminée du premier niveau, puis le gars des lumières donne le premier disque
+    switch = map_manager.maps['First_Level'].tmx_data.get_object_by_name('turnlight_on')
+    go_to(map_manager, 'First_Level', (switch.x, switch.y))
+    # une frame de plus pour qu'une carte streamée charge le chunk de l'interrupteur
+    timed_step(game, frame_times)
+    press(game, frame_times, pygame.K_SPACE)
+    if not state.flag('lights_on'):
+        state.set_flag('lights_on')
+        forced += 1
+    for world, npc in find_npc(map_manager, LightsGuy):
+        forced += not talk(game, frame_times, world, npc)
+
+    for world, npc in find_npc(map_manager, DiskGiver):
+        forced += not talk(game, frame_times, world, npc)
+
+    # une énigme ratée garde son disque : on le donne pour aller jusqu'au Boss quand même
+    for disk in ('cd1', 'cd2', 'cd3', 'cd4'):
+        if not state.has(disk):
+            state.give(disk)
+            forced += 1
+
+    for world, npc in find_npc(map_manager, Boss):
+        forced += not talk(game, frame_times, world, npc)
+    if not map_manager.endgame:
+        map_manager.start_endgame()
+        forced += 1
+    return forced
+
+
+def play_cycle(game, frames, rng):
+    """Une partie : marche au hasard, quête complète, fin du jeu, retour au Spawn."""
+    map_manager = game.map_manager
+    frame_times = []
+    pressed = defaultdict(bool)
+
+    for frame in range(frames):
+        if frame % 30 == 0:
+            pressed = defaultdict(bool, {rng.choice(MOVES): True})
+        if frame % 200 == 199:
+            portals = map_manager.get_map().portals
+            if portals:
+                map_manager.take_portal(rng.choice(portals))
+        timed_step(game, frame_times, pressed=pressed)
+
+    forced = play_quest(game, frame_times)
+
+    # on avance l'horloge de l'écran final pour que update appelle reset_game
+    map_manager.endgame_time -= 27001
+    while map_manager.endgame:
+        timed_step(game, frame_times)
+
+    return frame_times, forced
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cycles', type=int, default=30)
+    parser.add_argument('--frames', type=int, default=2000, help='frames de jeu par cycle')
+    parser.add_argument('--warmup', type=int, default=3, help='cycles ignorés pour les tendances')
+    parser.add_argument('--max-rss-kb', type=float, default=256, help='croissance RSS tolérée par cycle')
+    parser.add_argument('--max-traced-kb', type=float, default=64, help='croissance tracemalloc tolérée par cycle')
+    parser.add_argument('--max-p95-ms', type=float, default=0.05, help='dérive du 95e centile tolérée par cycle')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--leak-surfaces', type=int, default=0, help='surfaces gardées exprès à chaque cycle')
+    parser.add_argument('--top', type=int, default=5, help='allocations les plus en croissance affichées par cycle')
+    args = parser.parse_args()
+
+    pygame.init()
+    from game import Game
+
+    tracemalloc.start(10)
+    ghost_folder = tempfile.TemporaryDirectory(prefix='soak-ghosts-')
+    game = Game(ghost_folder=ghost_folder.name)
+    game.start_game()
+    rng = random.Random(args.seed)
+
+    samples = []
+    leaked = []
+    first_snapshot = previous_snapshot = None
+    for cycle in range(args.cycles):
+        frame_times, forced = play_cycle(game, args.frames, rng)
+        leaked += [pygame.Surface((16, 16)) for _ in range(args.leak_surfaces)]
+        gc.collect()
+
+        snapshot = tracemalloc.take_snapshot()
+        if cycle == args.warmup:
+            first_snapshot = snapshot
+        sample = {
+            'rss_kb': rss_kb(),
+            'traced_kb': tracemalloc.get_traced_memory()[0] / 1024,
+            'surfaces': count_surfaces(),
+            'channels': busy_channels(),
+            'p50_ms': percentile(frame_times, 0.5),
+            'p95_ms': percentile(frame_times, 0.95),
+            'p99_ms': percentile(frame_times, 0.99),
+        }
+        samples.append(sample)
+        print(f"cycle {cycle:3d}  rss {sample['rss_kb']:8.0f} KB  traced {sample['traced_kb']:8.0f} KB  "
+              f"surfaces {sample['surfaces']:5d}  channels {sample['channels']:2d}  "
+              f"frame p50/p95/p99 {sample['p50_ms']:.2f}/{sample['p95_ms']:.2f}/{sample['p99_ms']:.2f} ms  "
+              f"étapes forcées {forced}")
+        if previous_snapshot is not None:
+            for stat in snapshot.compare_to(previous_snapshot, 'lineno')[:args.top]:
+                print(f'    {stat}')
+        previous_snapshot = snapshot
+
+    if first_snapshot is not None:
+        print('\nplus fortes croissances depuis la fin du préchauffage :')
+        for stat in snapshot.compare_to(first_snapshot, 'lineno')[:10]:
+            print(f'  {stat}')
+
+    trend = samples[args.warmup:]
+    if len(trend) < 3:
+        print('\npas assez de cycles après le préchauffage pour juger une tendance')
+        return 0
+
+    limits = {
+        'rss_kb': args.max_rss_kb,
+        'traced_kb': args.max_traced_kb,
+        'surfaces': 0.5,
+        'channels': 0.5,
+        'p95_ms': args.max_p95_ms,
+    }
+    failures = []
+    print()
+    for name, limit in limits.items():
+        value = slope([sample[name] for sample in trend])
+        status = 'ÉCHEC' if value > limit else 'ok'
+        print(f'{name:10s} {value:+10.3f} par cycle (limite {limit}) {status}')
+        if value > limit:
+            failures.append(name)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
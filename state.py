@@ -0,0 +1,63 @@
+from collections import defaultdict
+
+
+class GameState:
+    """Avancement de la partie : objets ramassés et drapeaux de quête.
+
+    Les objets sont les bits d'un entier, les drapeaux un dictionnaire :
+    toutes les questions sont en O(1). Plutôt que d'interroger l'état à
+    chaque frame, le HUD et les quêtes s'abonnent à une clé ('items' ou le
+    nom d'un drapeau) et sont prévenus seulement quand elle change.
+    """
+
+    def __init__(self):
+        self.item_bits = {}  # nom de l'objet -> bit
+        self.items = 0
+        self.flags = {}
+        self.subscribers = defaultdict(list)
+
+    def bit(self, item):
+        if item not in self.item_bits:
+            self.item_bits[item] = 1 << len(self.item_bits)
+        return self.item_bits[item]
+
+    def mask(self, items):
+        mask = 0
+        for item in items:
+            mask |= self.bit(item)
+        return mask
+
+    def has(self, item):
+        return self.items & self.bit(item) != 0
+
+    def has_all(self, mask):
+        # mask vient de GameState.mask, calculé une fois
+        return self.items & mask == mask
+
+    def give(self, item):
+        if not self.has(item):
+            self.items |= self.bit(item)
+            self.notify('items')
+
+    def flag(self, name):
+        return self.flags.get(name, False)
+
+    def set_flag(self, name, value=True):
+        if self.flag(name) != value:
+            self.flags[name] = value
+            self.notify(name)
+
+    def subscribe(self, key, callback):
+        self.subscribers[key].append(callback)
+
+    def notify(self, key):
+        for callback in self.subscribers[key]:
+            callback(self)
+
+    def reset(self):
+        # tout remettre à zéro d'un coup, puis prévenir chaque abonné une seule fois
+        self.items = 0
+        self.flags.clear()
+        for callbacks in list(self.subscribers.values()):
+            for callback in callbacks:
+                callback(self)
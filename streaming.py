@@ -0,0 +1,420 @@
+from array import array
+from dataclasses import dataclass, field
+import os
+import queue
+import threading
+import xml.etree.ElementTree as ElementTree
+import pygame
+import pyscroll
+from atlas import assets
+from pytmx.pytmx import decode_gid, unpack_gids
+from pytmx.util_pygame import handle_transformation
+from tile_animation import AnimatedTiles
+
+# taille d'un chunk en tuiles (celle utilisée par Tiled pour les cartes infinies)
+CHUNK_SIZE = 16
+
+
+def is_infinite(filename):
+    # on ne lit que la balise <map>, pas toute la carte
+    for _, node in ElementTree.iterparse(filename, events=('start',)):
+        return node.get('infinite') == '1'
+
+
+@dataclass
+class TmxObject:
+    # mêmes attributs que les objets pytmx utilisés par le jeu
+    id: int
+    name: str
+    type: str
+    x: float
+    y: float
+    width: float
+    height: float
+
+
+@dataclass
+class Chunk:
+    key: tuple
+    layers: list  # une array('I') de gids par calque
+    walls: dict = field(default_factory=dict)  # id -> pygame.Rect
+    interactions: dict = field(default_factory=dict)  # id -> TmxObject
+    animated: list = field(default_factory=list)  # (x, y, calque, gid) des tuiles animées
+
+
+class StreamedTmx:
+    """Index d'une carte TMX découpée en chunks.
+
+    La carte est lue une seule fois, en flux : chaque chunk de chaque calque
+    est gardé tel qu'il est écrit dans le fichier (encodé, compressé), et
+    les objets sont rangés par chunk. Les tuiles ne sont décodées que
+    lorsqu'un chunk est chargé par le ChunkStreamer, sur son thread.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.tilewidth = 0
+        self.tileheight = 0
+        self.tilesets = []  # (firstgid, tileset_node, dossier du tileset)
+        self.animations = {}  # gid -> [(gid de la frame, durée en ms)]
+        self.layer_count = 0
+        self.packed = {}  # (cx, cy) -> [(calque, x, y, largeur, hauteur, données)]
+        self.objects = {}  # (cx, cy) -> [TmxObject]
+        self.named = {}  # nom -> TmxObject
+        self.origin = (0, 0)  # décalage en tuiles pour n'avoir que des coordonnées positives
+        self.size = (0, 0)  # taille en tuiles
+
+        raw_chunks = []
+        raw_objects = []
+        folder = os.path.dirname(filename)
+        path = []  # balises ouvertes, pour ne garder que les enfants directs de <map>
+        layer = encoding = compression = None
+
+        for event, node in ElementTree.iterparse(filename, events=('start', 'end')):
+            if event == 'start':
+                path.append(node.tag)
+                if node.tag == 'map':
+                    self.tilewidth = int(node.get('tilewidth'))
+                    self.tileheight = int(node.get('tileheight'))
+                elif node.tag == 'layer' and len(path) == 2:
+                    layer = None
+                    if node.get('visible') != '0':
+                        layer = self.layer_count
+                        self.layer_count += 1
+                elif node.tag == 'data' and len(path) == 3:
+                    encoding = node.get('encoding')
+                    compression = node.get('compression')
+                continue
+
+            path.pop()
+            if node.tag == 'tileset' and len(path) == 1:
+                self.tilesets.append(self.read_tileset(node, folder))
+
+            elif node.tag == 'chunk' and path[1:] == ['layer', 'data']:
+                if layer is not None:
+                    # le chunk reste encodé : il n'est décodé qu'au chargement
+                    raw_chunks.append((layer, int(node.get('x')), int(node.get('y')),
+                                       int(node.get('width')), int(node.get('height')),
+                                       (node.text, encoding, compression)))
+                node.clear()
+
+            elif node.tag == 'layer' and len(path) == 1:
+                data = node.find('data')
+                if layer is not None and data.find('chunk') is None:
+                    # carte finie : un seul bloc pour tout le calque, décodé une fois
+                    raw_chunks.append((layer, 0, 0, int(node.get('width')), int(node.get('height')),
+                                       array('I', unpack_gids(data.text, encoding, compression))))
+                node.clear()
+
+            elif node.tag == 'object' and path[1:] == ['objectgroup']:
+                raw_objects.append(TmxObject(int(node.get('id', 0)), node.get('name'),
+                                             node.get('type') or node.get('class'),
+                                             float(node.get('x', 0)), float(node.get('y', 0)),
+                                             float(node.get('width', 0)), float(node.get('height', 0))))
+
+        if raw_chunks:
+            left = min(x for _, x, _, _, _, _ in raw_chunks)
+            top = min(y for _, _, y, _, _, _ in raw_chunks)
+            right = max(x + w for _, x, _, w, _, _ in raw_chunks)
+            bottom = max(y + h for _, _, y, _, h, _ in raw_chunks)
+            self.origin = (left, top)
+            self.size = (right - left, bottom - top)
+
+        self.index_chunks(raw_chunks)
+        self.index_objects(raw_objects)
+
+        for firstgid, node, _ in self.tilesets:
+            for tile in node.iter('tile'):
+                animation = tile.find('animation')
+                if animation is not None:
+                    self.animations[firstgid + int(tile.get('id'))] = [
+                        (firstgid + int(frame.get('tileid')), int(frame.get('duration')))
+                        for frame in animation.iter('frame')]
+
+    @staticmethod
+    def read_tileset(node, folder):
+        firstgid = int(node.get('firstgid'))
+        source = node.get('source')
+        if source:
+            path = os.path.join(folder, source)
+            node = ElementTree.parse(path).getroot()
+            folder = os.path.dirname(path)
+        return firstgid, node, folder
+
+    def index_chunks(self, raw_chunks):
+        # les chunks de Tiled font 16x16 et sont alignés : en général un bloc = un chunk
+        ox, oy = self.origin
+        for layer, x, y, w, h, data in raw_chunks:
+            x, y = x - ox, y - oy
+            for cy in range(y // CHUNK_SIZE, (y + h - 1) // CHUNK_SIZE + 1):
+                for cx in range(x // CHUNK_SIZE, (x + w - 1) // CHUNK_SIZE + 1):
+                    self.packed.setdefault((cx, cy), []).append((layer, x, y, w, h, data))
+
+    def index_objects(self, raw_objects):
+        ox = self.origin[0] * self.tilewidth
+        oy = self.origin[1] * self.tileheight
+        chunk_w = CHUNK_SIZE * self.tilewidth
+        chunk_h = CHUNK_SIZE * self.tileheight
+
+        for obj in raw_objects:
+            obj.x -= ox
+            obj.y -= oy
+            if obj.name:
+                self.named[obj.name] = obj
+            if obj.type not in ('collision', 'interaction'):
+                continue
+
+            # un objet à cheval sur plusieurs chunks est rangé dans chacun
+            right = int(obj.x + max(obj.width, 1) - 1)
+            bottom = int(obj.y + max(obj.height, 1) - 1)
+            for cy in range(int(obj.y) // chunk_h, bottom // chunk_h + 1):
+                for cx in range(int(obj.x) // chunk_w, right // chunk_w + 1):
+                    self.objects.setdefault((cx, cy), []).append(obj)
+
+    def get_object_by_name(self, name):
+        return self.named[name]
+
+    def load_chunk(self, key):
+        layers = [None] * self.layer_count
+        left, top = key[0] * CHUNK_SIZE, key[1] * CHUNK_SIZE
+        for layer, x, y, w, h, data in self.packed.get(key, []):
+            gids = data if isinstance(data, array) else array('I', unpack_gids(*data))
+            if (x, y, w, h) == (left, top, CHUNK_SIZE, CHUNK_SIZE):
+                layers[layer] = gids
+                continue
+
+            # bloc d'une autre taille : on recopie la partie qui tombe dans ce chunk
+            if layers[layer] is None:
+                layers[layer] = array('I', bytes(4 * CHUNK_SIZE * CHUNK_SIZE))
+            x1, x2 = max(x, left), min(x + w, left + CHUNK_SIZE)
+            for ty in range(max(y, top), min(y + h, top + CHUNK_SIZE)):
+                row = (ty - y) * w - x
+                layers[layer][(ty - top) * CHUNK_SIZE + x1 - left:(ty - top) * CHUNK_SIZE + x2 - left] = \
+                    gids[row + x1:row + x2]
+
+        chunk = Chunk(key, layers)
+        if self.animations:
+            # repérées ici, sur le thread du streamer, plutôt qu'à l'arrivée du chunk
+            for l, gids in enumerate(layers):
+                if gids is None:
+                    continue
+                for index, gid in enumerate(gids):
+                    if gid in self.animations:
+                        chunk.animated.append((left + index % CHUNK_SIZE, top + index // CHUNK_SIZE, l, gid))
+        for obj in self.objects.get(key, []):
+            if obj.type == 'collision':
+                chunk.walls[obj.id] = pygame.Rect(obj.x, obj.y, obj.width, obj.height)
+            else:
+                chunk.interactions[obj.id] = obj
+        return chunk
+
+
+class TileImages:
+    """Images des tuiles, découpées dans les tilesets à la première demande."""
+
+    def __init__(self, tmx):
+        self.tilesets = sorted(tmx.tilesets, key=lambda t: t[0], reverse=True)
+        self.sheets = {}
+        self.images = {}
+
+    def sheet(self, firstgid, node, folder):
+        if firstgid not in self.sheets:
+            image_node = node.find('image')
+            image = assets.load(os.path.join(folder, image_node.get('source'))).convert_alpha()
+            if image_node.get('trans'):
+                image.set_colorkey(pygame.Color('#' + image_node.get('trans')))
+            self.sheets[firstgid] = image
+        return self.sheets[firstgid]
+
+    def get(self, raw_gid):
+        try:
+            return self.images[raw_gid]
+        except KeyError:
+            pass
+
+        gid, flags = decode_gid(raw_gid)
+        image = None
+        for firstgid, node, folder in self.tilesets:
+            if gid >= firstgid:
+                sheet = self.sheet(firstgid, node, folder)
+                w, h = int(node.get('tilewidth')), int(node.get('tileheight'))
+                margin, spacing = int(node.get('margin', 0)), int(node.get('spacing', 0))
+                columns = int(node.get('columns'))
+                index = gid - firstgid
+                x = margin + (index % columns) * (w + spacing)
+                y = margin + (index // columns) * (h + spacing)
+                image = handle_transformation(sheet.subsurface((x, y, w, h)), flags)
+                break
+
+        self.images[raw_gid] = image
+        return image
+
+
+class ChunkStreamer:
+    """Garde en mémoire les chunks autour du joueur.
+
+    Les chunks voisins sont décodés sur un thread en arrière-plan, en
+    avance dans la direction du mouvement, et ceux qui sont trop loin
+    derrière le joueur sont libérés.
+    """
+
+    def __init__(self, tmx, radius=2):
+        self.tmx = tmx
+        self.radius = radius
+        self.resident = {}
+        self.pending = set()
+        self.map_layer = None
+        self.center = None
+
+        self.requests = queue.Queue()
+        self.loaded = queue.Queue()
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def worker(self):
+        while True:
+            key = self.requests.get()
+            if key is None:
+                return
+            self.loaded.put(self.tmx.load_chunk(key))
+
+    def stop(self):
+        self.requests.put(None)
+
+    def chunk_at(self, position):
+        chunk_w = CHUNK_SIZE * self.tmx.tilewidth
+        chunk_h = CHUNK_SIZE * self.tmx.tileheight
+        return int(position[0]) // chunk_w, int(position[1]) // chunk_h
+
+    def around(self, key, radius):
+        cx, cy = key
+        return {(x, y) for x in range(cx - radius, cx + radius + 1)
+                for y in range(cy - radius, cy + radius + 1)}
+
+    def update(self, position, velocity):
+        """Met à jour les chunks chargés, renvoie True si ils ont changé."""
+        loaded = []
+        key = self.chunk_at(position)
+        wanted = self.around(key, self.radius)
+
+        # le chunk du joueur doit être là tout de suite (apparition, téléportation)
+        if key not in self.resident:
+            for missing in wanted - self.resident.keys():
+                self.resident[missing] = self.tmx.load_chunk(missing)
+                self.pending.discard(missing)
+                loaded.append(self.resident[missing])
+
+        # précharger la rangée suivante dans la direction du mouvement
+        dx = (velocity[0] > 0) - (velocity[0] < 0)
+        dy = (velocity[1] > 0) - (velocity[1] < 0)
+        ahead = {(x + dx, y + dy) for x, y in wanted} | wanted
+        for missing in ahead - self.resident.keys() - self.pending:
+            self.pending.add(missing)
+            self.requests.put(missing)
+
+        keep = self.around(key, self.radius + 1)
+        while not self.loaded.empty():
+            chunk = self.loaded.get()
+            self.pending.discard(chunk.key)
+            if chunk.key in keep and chunk.key not in self.resident:
+                self.resident[chunk.key] = chunk
+                loaded.append(chunk)
+
+        evicted = self.resident.keys() - keep
+        for old in evicted:
+            del self.resident[old]
+
+        changed = bool(loaded or evicted)
+        if changed and self.map_layer is not None:
+            self.map_layer.data.update_chunks(loaded, evicted)
+            self.map_layer.reload()
+        return changed
+
+    def is_resident(self, position):
+        return self.chunk_at(position) in self.resident
+
+    def walls(self):
+        walls = {}
+        for chunk in self.resident.values():
+            walls.update(chunk.walls)
+        return list(walls.values())
+
+    def interactions(self):
+        interactions = {}
+        for chunk in self.resident.values():
+            interactions.update(chunk.interactions)
+        return list(interactions.values())
+
+
+class StreamedMapData(AnimatedTiles, pyscroll.data.PyscrollDataAdapter):
+    """Source de tuiles pyscroll qui ne lit que les chunks chargés."""
+
+    def __init__(self, streamer):
+        super().__init__()
+        self.streamer = streamer
+        self.tiles = TileImages(streamer.tmx)
+        self.reload_animations()
+
+    @property
+    def tile_size(self):
+        return self.streamer.tmx.tilewidth, self.streamer.tmx.tileheight
+
+    @property
+    def map_size(self):
+        return self.streamer.tmx.size
+
+    @property
+    def visible_tile_layers(self):
+        return range(self.streamer.tmx.layer_count)
+
+    @property
+    def visible_object_layers(self):
+        return []
+
+    def reload_data(self):
+        pass
+
+    def convert_surfaces(self, parent, alpha=False):
+        pass
+
+    def get_animations(self):
+        return self.streamer.tmx.animations.items()
+
+    def update_chunks(self, loaded, evicted):
+        # seules les tuiles animées des chunks arrivés ou libérés changent
+        for cx, cy in evicted:
+            self.remove_animated_tiles(pygame.Rect(cx * CHUNK_SIZE, cy * CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE))
+        for chunk in loaded:
+            self.add_animated_tiles(chunk.animated)
+
+    def _get_tile_image(self, x, y, l):
+        chunk = self.streamer.resident.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        if chunk is None or chunk.layers[l] is None:
+            return None
+        gid = chunk.layers[l][(y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE]
+        return self.tiles.get(gid) if gid else None
+
+    def _get_tile_image_by_id(self, id):
+        return self.tiles.get(id)
+
+    def get_tile_images_by_rect(self, rect):
+        x1, y1 = rect[0], rect[1]
+        x2, y2 = x1 + rect[2] - 1, y1 + rect[3] - 1
+        resident = self.streamer.resident
+        get_image = self.tiles.get
+
+        for layer in self.visible_tile_layers:
+            for cy in range(max(y1, 0) // CHUNK_SIZE, y2 // CHUNK_SIZE + 1):
+                for cx in range(max(x1, 0) // CHUNK_SIZE, x2 // CHUNK_SIZE + 1):
+                    chunk = resident.get((cx, cy))
+                    if chunk is None or chunk.layers[layer] is None:
+                        continue
+                    gids = chunk.layers[layer]
+                    for ty in range(max(y1, cy * CHUNK_SIZE), min(y2, cy * CHUNK_SIZE + CHUNK_SIZE - 1) + 1):
+                        row = (ty % CHUNK_SIZE) * CHUNK_SIZE
+                        for tx in range(max(x1, cx * CHUNK_SIZE), min(x2, cx * CHUNK_SIZE + CHUNK_SIZE - 1) + 1):
+                            gid = gids[row + tx % CHUNK_SIZE]
+                            if gid:
+                                image = self._animated_tile.get((tx, ty, layer)) or get_image(gid)
+                                if image:
+                                    yield tx, ty, layer, image
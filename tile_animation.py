@@ -0,0 +1,139 @@
+from heapq import heapify, heappop, heappush
+import pyscroll
+
+# taille des cases qui rangent les positions des tuiles animées, en tuiles
+CELL_SIZE = 16
+
+
+class AnimationGroup:
+    """Tuiles animées qui partagent les mêmes durées de frames.
+
+    Elles changent de frame ensemble : un seul réveil pour tout le groupe,
+    et seules les positions dans la vue sont redessinées.
+    """
+
+    def __init__(self, durations, now):
+        self.durations = durations
+        self.index = 0
+        self.next = now + durations[0]
+        self.frames = {}  # gid -> images des frames
+        self.cells = {}  # (cx, cy) -> [(x, y, calque, gid)]
+
+    def __lt__(self, other):
+        return self.next < other.next
+
+    def add(self, x, y, l, gid):
+        self.cells.setdefault((x // CELL_SIZE, y // CELL_SIZE), []).append((x, y, l, gid))
+
+    def remove(self, rect):
+        # retire (et renvoie) les tuiles du rectangle, en tuiles
+        removed = []
+        for cy in range(rect.top // CELL_SIZE, (rect.bottom - 1) // CELL_SIZE + 1):
+            for cx in range(rect.left // CELL_SIZE, (rect.right - 1) // CELL_SIZE + 1):
+                tiles = self.cells.pop((cx, cy), None)
+                if tiles is None:
+                    continue
+                kept = []
+                for tile in tiles:
+                    (removed if rect.collidepoint(tile[0], tile[1]) else kept).append(tile)
+                if kept:
+                    self.cells[(cx, cy)] = kept
+        return removed
+
+    def advance(self, now):
+        self.index = (self.index + 1) % len(self.durations)
+        self.next = now + self.durations[self.index]
+
+    def visible(self, view):
+        for cy in range(view.top // CELL_SIZE, (view.bottom - 1) // CELL_SIZE + 1):
+            for cx in range(view.left // CELL_SIZE, (view.right - 1) // CELL_SIZE + 1):
+                for x, y, l, gid in self.cells.get((cx, cy), ()):
+                    if view.collidepoint(x, y):
+                        yield x, y, l, gid
+
+
+class AnimatedTiles:
+    """Remplace la gestion des animations de PyscrollDataAdapter.
+
+    Les animations sont regroupées par durées de frames, une seule fois :
+    les groupes et leur horloge survivent aux BufferedRenderer.reload, les
+    tuiles ne reviennent donc pas à leur première frame. Les positions des
+    tuiles animées sont données par la source de données (add_animated_tiles,
+    remove_animated_tiles), et à chaque changement de frame seules les cases
+    de la vue qui contiennent une tuile animée sont renvoyées au renderer.
+    """
+
+    # gid -> AnimationGroup, créé au premier reload_animations
+    _group_of = None
+
+    def reload_animations(self):
+        self._update_time()
+        if self._group_of is not None:
+            return
+
+        self._animated_tile = dict()
+        # utilisés par TiledMapData.get_tile_images_by_rect, le suivi y est inutile ici
+        self._tracked_gids = set()
+        self._animation_map = dict()
+
+        groups = {}
+        self._group_of = {}
+        for gid, frames in self.get_animations():
+            durations = tuple(max(1, duration) for _, duration in frames)
+            if durations not in groups:
+                groups[durations] = AnimationGroup(durations, self._last_time)
+            groups[durations].frames[gid] = [self._get_tile_image_by_id(frame_gid) for frame_gid, _ in frames]
+            self._group_of[gid] = groups[durations]
+
+        self._animation_queue = list(groups.values())
+        heapify(self._animation_queue)
+
+    def add_animated_tiles(self, tiles):
+        # (x, y, calque, gid) : la tuile prend tout de suite la frame en cours de son groupe
+        for x, y, l, gid in tiles:
+            group = self._group_of.get(gid)
+            if group is not None:
+                group.add(x, y, l, gid)
+                self._animated_tile[(x, y, l)] = group.frames[gid][group.index]
+
+    def remove_animated_tiles(self, rect):
+        for group in self._animation_queue:
+            for x, y, l, _ in group.remove(rect):
+                self._animated_tile.pop((x, y, l), None)
+
+    def process_animation_queue(self, tile_view):
+        new_tiles = list()
+        self._update_time()
+        if not self._animation_queue or self._animation_queue[0].next > self._last_time:
+            return new_tiles
+
+        columns = set()
+        while self._animation_queue[0].next <= self._last_time:
+            group = heappop(self._animation_queue)
+            group.advance(self._last_time)
+            heappush(self._animation_queue, group)
+
+            for x, y, l, gid in group.visible(tile_view):
+                self._animated_tile[(x, y, l)] = group.frames[gid][group.index]
+                columns.add((x, y))
+
+        # toute la colonne de calques est redessinée, comme le fait pyscroll
+        for x, y in columns:
+            for layer in self.visible_tile_layers:
+                image = self.get_tile_image(x, y, layer)
+                if image:
+                    new_tiles.append((x, y, layer, image))
+
+        return new_tiles
+
+
+class AnimatedMapData(AnimatedTiles, pyscroll.data.TiledMapData):
+    """Données pytmx avec les animations de tuiles regroupées."""
+
+    def __init__(self, tmx):
+        super().__init__(tmx)
+        # la carte ne change pas : les positions sont indexées une fois au chargement
+        if self._group_of:
+            self.add_animated_tiles((x, y, l, gid) for l in self.tmx.visible_tile_layers
+                                    for y, row in enumerate(self.tmx.layers[l].data)
+                                    for x, gid in enumerate(row) if gid in self._group_of)